@@ -5,14 +5,90 @@ Works as a bridge between personal devices and work PC
 import streamlit as st
 import os
 import io
-from google.auth.transport.requests import Request
+import time
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from requests import HTTPError
+from requests.adapters import HTTPAdapter
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 
 # Configuration
 SCOPES = ['https://www.googleapis.com/auth/drive']
 FOLDER_NAME = 'WorkPC_Transfer'
+FOLDER_QUERY = f"name='{FOLDER_NAME}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+FILES_FIELDS = "nextPageToken, files(id, name, size, mimeType, modifiedTime)"
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files'
+DRIVE_ABOUT_URL = 'https://www.googleapis.com/drive/v3/about'
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+# Keep concurrent uploads well under Drive's per-user request rate
+UPLOAD_WORKERS = 4
+# Files below this size go up in a single multipart request
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Drive accepts at most 100 calls per batch request
+BATCH_SIZE = 100
+# Transient Drive errors worth retrying (403 only when it is a rate limit)
+RETRYABLE_STATUSES = {403, 429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 6
+# Refresh the access token this long before it expires
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+TOKEN_REFRESH_RETRY_SECONDS = 60
+TOKEN_REFRESHER_NAME = 'drive-token-refresher'
+SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+# File icons by MIME main type, then by keyword in the subtype
+MIME_TYPE_ICONS = {'image': "🖼️", 'video': "🎬", 'audio': "🎵"}
+MIME_SUBTYPE_ICONS = (
+    ('folder', "📁"),
+    ('image', "🖼️"),
+    ('pdf', "📕"),
+    ('zip', "🗜️"),
+    ('compressed', "🗜️"),
+    ('video', "🎬"),
+    ('audio', "🎵"),
+    ('spreadsheet', "📊"),
+    ('excel', "📊"),
+    ('document', "📝"),
+    ('word', "📝"),
+)
+
+def is_retryable(error):
+    """Check whether a Drive API error is transient."""
+    if isinstance(error, HttpError):
+        status, body = error.resp.status, error.content.decode('utf-8', 'replace')
+    elif isinstance(error, HTTPError) and error.response is not None:
+        status, body = error.response.status_code, error.response.text
+    else:
+        return False
+    if status == 403:
+        return 'ratelimitexceeded' in body.lower()
+    return status in RETRYABLE_STATUSES
+
+def with_retry(func):
+    """Retry a Drive call on transient errors with exponential backoff and jitter."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except (HttpError, HTTPError) as e:
+                if attempt == MAX_ATTEMPTS - 1 or not is_retryable(e):
+                    raise
+                time.sleep((2 ** attempt) * 0.25 + random.random() * 0.1)
+    return wrapper
+
+def save_token(creds):
+    """Save a refreshed token locally if using token.json."""
+    if os.path.exists('token.json'):
+        with open('token.json', 'w') as token_file:
+            token_file.write(creds.to_json())
 
 def get_credentials():
     """Get Google credentials from secrets or local file."""
@@ -45,10 +121,7 @@ def get_credentials():
         if creds.expired and creds.refresh_token:
             try:
                 creds.refresh(Request())
-                # Save refreshed token locally if using token.json
-                if os.path.exists('token.json'):
-                    with open('token.json', 'w') as token_file:
-                        token_file.write(creds.to_json())
+                save_token(creds)
             except Exception as e:
                 st.error(f"Failed to refresh token: {e}")
                 st.stop()
@@ -58,15 +131,89 @@ def get_credentials():
 
     return creds
 
+def refresh_token_loop(creds, stop_event):
+    """Keep the access token fresh so UI requests never wait on a refresh."""
+    while True:
+        # google-auth stores expiry as naive UTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if stop_event.wait(max((creds.expiry - TOKEN_REFRESH_MARGIN - now).total_seconds(), 0)):
+            return
+        try:
+            creds.refresh(Request())
+            save_token(creds)
+        except Exception:
+            if stop_event.wait(TOKEN_REFRESH_RETRY_SECONDS):
+                return
+
+def start_token_refresher(creds):
+    """Start the refresher for creds, stopping any left over from an earlier cache entry.
+
+    Streamlit re-executes this module on every rerun and clears cache_resource
+    on demand, so the running thread itself is the only reliable record of a
+    previous refresher.
+    """
+    for thread in threading.enumerate():
+        if thread.name == TOKEN_REFRESHER_NAME:
+            thread.stop_event.set()
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=refresh_token_loop,
+        args=(creds, stop_event),
+        name=TOKEN_REFRESHER_NAME,
+        daemon=True
+    )
+    thread.stop_event = stop_event
+    thread.start()
+
+@st.cache_resource
+def get_shared_credentials():
+    """Load credentials once per process and start their background refresher."""
+    creds = get_credentials()
+    # Tokens from secrets carry no expiry, so google-auth treats them as valid;
+    # refresh now so the refresher has an expiry to schedule against
+    if creds.expiry is None and creds.refresh_token:
+        try:
+            creds.refresh(Request())
+            save_token(creds)
+        except Exception as e:
+            st.error(f"Failed to refresh token: {e}")
+            st.stop()
+    if creds.expiry is not None:
+        start_token_refresher(creds)
+    return creds
+
+@st.cache_resource
+def get_discovery_document():
+    """Load the Drive v3 discovery document bundled with google-api-python-client."""
+    return get_static_doc('drive', 'v3')
+
+def build_drive_service(creds):
+    """Build a Drive service from the bundled discovery document, without fetching it."""
+    return build_from_document(get_discovery_document(), credentials=creds)
+
 def get_drive_service():
     """Create Google Drive service (fresh connection each time)."""
-    creds = get_credentials()
-    return build('drive', 'v3', credentials=creds, cache_discovery=False)
+    return build_drive_service(get_shared_credentials())
 
+def warm_up_session(session):
+    """Open a pooled connection with a cheap request so later calls reuse it."""
+    try:
+        session.get(DRIVE_ABOUT_URL, params={'fields': 'user(emailAddress)'})
+    except Exception:
+        pass
+
+@st.cache_resource
+def get_authorized_session():
+    """Create a shared, connection-pooled session for direct Drive REST calls."""
+    session = AuthorizedSession(get_shared_credentials())
+    session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+    threading.Thread(target=warm_up_session, args=(session,), daemon=True).start()
+    return session
+
+@with_retry
 def get_folder_id(service):
     """Get or create the WorkPC_Transfer folder."""
-    query = f"name='{FOLDER_NAME}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    results = service.files().list(q=query, fields="files(id)").execute()
+    results = service.files().list(q=FOLDER_QUERY, fields="files(id)").execute()
     files = results.get('files', [])
 
     if files:
@@ -79,60 +226,156 @@ def get_folder_id(service):
     folder = service.files().create(body=folder_metadata, fields='id').execute()
     return folder['id']
 
-def list_files(service, folder_id):
-    """List all files in the shared folder."""
-    query = f"'{folder_id}' in parents and trashed = false"
-    results = service.files().list(
-        q=query,
-        pageSize=100,
-        fields="files(id, name, size, mimeType, createdTime, modifiedTime)",
-        orderBy="modifiedTime desc"
-    ).execute()
-    return results.get('files', [])
-
-def upload_file(service, folder_id, file_name, file_content, mime_type):
-    """Upload a file to the shared folder."""
+def get_session_folder_id():
+    """Look up the folder ID once per session; it does not change while the app runs."""
+    if 'folder_id' not in st.session_state:
+        # Create the pooled session first so its warm-up overlaps the folder lookup
+        get_authorized_session()
+        st.session_state['folder_id'] = get_folder_id(get_drive_service())
+    return st.session_state['folder_id']
+
+@with_retry
+def list_files(session, folder_id):
+    """List all files in the shared folder, following every result page."""
+    params = {
+        'q': f"'{folder_id}' in parents and trashed = false",
+        'pageSize': 1000,
+        'fields': FILES_FIELDS,
+        'orderBy': "modifiedTime desc"
+    }
+    files = []
+    while True:
+        response = session.get(DRIVE_FILES_URL, params=params)
+        response.raise_for_status()
+        results = response.json()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+        params['pageToken'] = page_token
+
+@with_retry
+def upload_file(service, folder_id, file_name, fileobj, mime_type):
+    """Upload a file-like object to the shared folder."""
     file_metadata = {
         'name': file_name,
         'parents': [folder_id]
     }
-    media = MediaIoBaseUpload(
-        io.BytesIO(file_content),
-        mimetype=mime_type,
-        resumable=True
-    )
+    size = fileobj.seek(0, io.SEEK_END)
+    fileobj.seek(0)
+    if size < RESUMABLE_THRESHOLD:
+        media = MediaIoBaseUpload(
+            fileobj,
+            mimetype=mime_type,
+            resumable=False
+        )
+    else:
+        media = MediaIoBaseUpload(
+            fileobj,
+            mimetype=mime_type,
+            chunksize=UPLOAD_CHUNK_SIZE,
+            resumable=True
+        )
     file = service.files().create(
         body=file_metadata,
         media_body=media,
-        fields='id, name'
+        fields='id'
     ).execute()
     return file
 
-def download_file(service, file_id):
+def stream_file(session, file_id):
+    """Stream a file's contents from Google Drive in chunks."""
+    response = session.get(
+        f"{DRIVE_FILES_URL}/{file_id}",
+        params={'alt': 'media'},
+        stream=True
+    )
+    with response:
+        if not response.ok:
+            # Read the small error body before the stream closes, so is_retryable can see it
+            response.content
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+
+@with_retry
+def download_file(session, file_id):
     """Download a file from Google Drive."""
-    request = service.files().get_media(fileId=file_id)
-    file_content = io.BytesIO()
-    downloader = MediaIoBaseDownload(file_content, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-    file_content.seek(0)
-    return file_content
-
-def delete_file(service, file_id):
+    return b''.join(stream_file(session, file_id))
+
+@st.cache_resource
+def get_inflight_downloads():
+    """Shared in-flight map and lock used to coalesce downloads of the same file."""
+    return {}, threading.Lock()
+
+def download_coalesced(file_id):
+    """Download a file, sharing one request between concurrent callers for the same id.
+
+    st.cache_data only serialises callers with the same arguments; this also
+    covers callers that saw different modifiedTime values for one file.
+    """
+    inflight, lock = get_inflight_downloads()
+    session = get_authorized_session()
+    with lock:
+        future = inflight.get(file_id)
+        owner = future is None
+        if owner:
+            future = inflight[file_id] = Future()
+    if owner:
+        try:
+            future.set_result(download_file(session, file_id))
+        except BaseException as e:
+            # Complete the future even for Streamlit's control-flow exceptions,
+            # otherwise waiters would block forever
+            future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            with lock:
+                del inflight[file_id]
+    return future.result()
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def fetch_bytes(file_id, modified_time):
+    """Fetch file contents on demand; modifiedTime keys the cache so edits invalidate it."""
+    return download_coalesced(file_id)
+
+@with_retry
+def delete_file(session, file_id):
     """Delete a file from Google Drive."""
-    service.files().delete(fileId=file_id).execute()
+    response = session.delete(f"{DRIVE_FILES_URL}/{file_id}")
+    response.raise_for_status()
+
+def delete_files(service, file_ids):
+    """Delete several files using batch requests; returns the ids that failed."""
+    failed = []
+
+    def record_failure(request_id, response, exception):
+        if exception is not None:
+            failed.append(request_id)
+
+    for start in range(0, len(file_ids), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=record_failure)
+        for file_id in file_ids[start:start + BATCH_SIZE]:
+            batch.add(service.files().delete(fileId=file_id), request_id=file_id)
+        batch.execute()
+
+    return failed
+
+def get_file_icon(mime):
+    """Pick a display icon for a MIME type."""
+    main_type, _, subtype = mime.partition('/')
+    if main_type in MIME_TYPE_ICONS:
+        return MIME_TYPE_ICONS[main_type]
+    return next((icon for keyword, icon in MIME_SUBTYPE_ICONS if keyword in subtype), "📄")
 
 def format_size(size_bytes):
     """Format file size in human readable format."""
     if size_bytes is None:
         return "N/A"
     size_bytes = int(size_bytes)
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size_bytes < 1024:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024
-    return f"{size_bytes:.1f} TB"
+    # Each unit step is 10 bits, so the bit length picks the unit directly
+    unit = min(max(size_bytes.bit_length() - 1, 0) // 10, len(SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * unit)):.1f} {SIZE_UNITS[unit]}"
 
 # Page configuration
 st.set_page_config(
@@ -165,20 +408,31 @@ with tab1:
             status_text = st.empty()
 
             try:
-                service = get_drive_service()
-                folder_id = get_folder_id(service)
-
+                folder_id = get_session_folder_id()
+                creds = get_shared_credentials()
+                status_text.text(f"Uploading {len(uploaded_files)} file(s)...")
                 success_count = 0
-                for i, uploaded_file in enumerate(uploaded_files):
-                    status_text.text(f"Uploading: {uploaded_file.name}...")
-                    try:
-                        file_content = uploaded_file.read()
-                        mime_type = uploaded_file.type or 'application/octet-stream'
-                        upload_file(service, folder_id, uploaded_file.name, file_content, mime_type)
-                        success_count += 1
-                    except Exception as e:
-                        st.error(f"Failed to upload {uploaded_file.name}: {e}")
-                    progress_bar.progress((i + 1) / len(uploaded_files))
+                with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+                    # One service per upload, since httplib2 is not thread-safe
+                    futures = {
+                        executor.submit(
+                            upload_file,
+                            build_drive_service(creds),
+                            folder_id,
+                            uploaded_file.name,
+                            uploaded_file,
+                            uploaded_file.type or 'application/octet-stream'
+                        ): uploaded_file
+                        for uploaded_file in uploaded_files
+                    }
+                    for i, future in enumerate(as_completed(futures)):
+                        uploaded_file = futures[future]
+                        try:
+                            future.result()
+                            success_count += 1
+                        except Exception as e:
+                            st.error(f"Failed to upload {uploaded_file.name}: {e}")
+                        progress_bar.progress((i + 1) / len(uploaded_files))
 
                 status_text.text("Upload complete!")
                 if success_count > 0:
@@ -195,13 +449,16 @@ with tab2:
         refresh = st.button("🔄 Refresh")
 
     try:
-        service = get_drive_service()
-        folder_id = get_folder_id(service)
-        files = list_files(service, folder_id)
+        folder_id = get_session_folder_id()
+        files = list_files(get_authorized_session(), folder_id)
     except Exception as e:
         st.error(f"Failed to connect to Google Drive: {e}")
         files = []
 
+    delete_errors = st.session_state.pop('delete_errors', None)
+    if delete_errors:
+        st.error(f"Failed to delete: {', '.join(delete_errors)}")
+
     if not files:
         st.info("No files in the folder yet. Upload some files first!")
     else:
@@ -209,57 +466,56 @@ with tab2:
         st.divider()
 
         for file in files:
-            col1, col2, col3, col4 = st.columns([4, 1, 1, 1])
+            col0, col1, col2, col3, col4 = st.columns([0.5, 4, 1, 1, 1])
+
+            with col0:
+                st.checkbox("Select", key=f"sel_{file['id']}", label_visibility="collapsed")
 
             with col1:
-                mime = file.get('mimeType', '')
-                if 'folder' in mime:
-                    icon = "📁"
-                elif 'image' in mime:
-                    icon = "🖼️"
-                elif 'pdf' in mime:
-                    icon = "📕"
-                elif 'zip' in mime or 'compressed' in mime:
-                    icon = "🗜️"
-                elif 'video' in mime:
-                    icon = "🎬"
-                elif 'audio' in mime:
-                    icon = "🎵"
-                elif 'spreadsheet' in mime or 'excel' in mime:
-                    icon = "📊"
-                elif 'document' in mime or 'word' in mime:
-                    icon = "📝"
-                else:
-                    icon = "📄"
+                icon = get_file_icon(file.get('mimeType', ''))
                 st.write(f"{icon} **{file['name']}**")
 
             with col2:
                 st.write(format_size(file.get('size')))
 
             with col3:
-                try:
-                    # Create a new service for each download to avoid SSL issues
-                    dl_service = get_drive_service()
-                    file_content = download_file(dl_service, file['id'])
-                    st.download_button(
-                        label="⬇️",
-                        data=file_content,
-                        file_name=file['name'],
-                        key=f"dl_{file['id']}",
-                        help="Download this file"
-                    )
-                except Exception as e:
-                    st.write("❌")
+                # Only the rerun triggered by this click fetches the file
+                if st.button("⬇️", key=f"req_{file['id']}", help="Prepare download"):
+                    try:
+                        file_content = fetch_bytes(file['id'], file.get('modifiedTime'))
+                        st.download_button(
+                            label="💾",
+                            data=file_content,
+                            file_name=file['name'],
+                            key=f"dl_{file['id']}",
+                            help="Save this file"
+                        )
+                    except Exception as e:
+                        st.write("❌")
 
             with col4:
                 if st.button("🗑️", key=f"del_{file['id']}", help="Delete"):
                     try:
-                        del_service = get_drive_service()
-                        delete_file(del_service, file['id'])
+                        delete_file(get_authorized_session(), file['id'])
                         st.rerun()
                     except Exception as e:
                         st.error(f"Delete failed: {e}")
 
+        selected = [file['id'] for file in files if st.session_state.get(f"sel_{file['id']}")]
+        if selected:
+            st.divider()
+            if st.button(f"🗑️ Delete selected ({len(selected)})", type="primary"):
+                try:
+                    failed = delete_files(get_drive_service(), selected)
+                except Exception as e:
+                    st.error(f"Delete failed: {e}")
+                else:
+                    if failed:
+                        names = {file['id']: file['name'] for file in files}
+                        # Shown after the rerun, which drops the rows that were deleted
+                        st.session_state['delete_errors'] = [names[file_id] for file_id in failed]
+                    st.rerun()
+
 # Footer
 st.divider()
 with st.expander("ℹ️ Info"):
@@ -5,7 +5,11 @@ Deletes files older than 7 days.
 Designed to run via GitHub Actions.
 """
 import os
+import random
+import asyncio
 import logging
+import aiohttp
+import ciso8601
 from datetime import datetime, timedelta, timezone
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -14,7 +18,17 @@ from googleapiclient.discovery import build
 # Configuration
 SCOPES = ['https://www.googleapis.com/auth/drive']
 FOLDER_NAME = 'WorkPC_Transfer'
+FOLDER_QUERY = f"name='{FOLDER_NAME}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+FILES_FIELDS = "nextPageToken, files(id, name, modifiedTime)"
 MAX_AGE_DAYS = 7
+# Drive accepts at most 100 calls per batch request
+BATCH_SIZE = 100
+# Individual deletes in flight at once, to stay under Drive's per-user rate limit
+DELETE_CONCURRENCY = 5
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files'
+# Transient Drive errors worth retrying (403 only when it is a rate limit)
+RETRYABLE_STATUSES = {403, 429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 6
 
 # Setup logging
 logging.basicConfig(
@@ -55,16 +69,14 @@ def get_credentials():
     return creds
 
 
-def get_drive_service():
+def get_drive_service(creds):
     """Create Google Drive service."""
-    creds = get_credentials()
-    return build('drive', 'v3', credentials=creds, cache_discovery=False)
+    return build('drive', 'v3', credentials=creds, cache_discovery=False, static_discovery=True)
 
 
 def get_folder_id(service):
     """Get the WorkPC_Transfer folder ID."""
-    query = f"name='{FOLDER_NAME}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    results = service.files().list(q=query, fields="files(id)").execute()
+    results = service.files().list(q=FOLDER_QUERY, fields="files(id)").execute()
     files = results.get('files', [])
 
     if not files:
@@ -74,22 +86,90 @@ def get_folder_id(service):
     return files[0]['id']
 
 
-def list_files(service, folder_id):
-    """List all files in the folder with metadata."""
-    query = f"'{folder_id}' in parents and trashed = false"
-    results = service.files().list(
-        q=query,
-        pageSize=100,
-        fields="files(id, name, modifiedTime, size)",
-        orderBy="modifiedTime asc"
-    ).execute()
-    return results.get('files', [])
-
-
-def delete_file(service, file_id, file_name):
-    """Delete a file from Google Drive."""
-    service.files().delete(fileId=file_id).execute()
-    logger.info(f"Deleted: {file_name}")
+def list_files(service, folder_id, modified_before):
+    """List files in the folder last modified before the given UTC time."""
+    cutoff = modified_before.strftime('%Y-%m-%dT%H:%M:%S')
+    query = f"'{folder_id}' in parents and trashed = false and modifiedTime < '{cutoff}'"
+    files = []
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=query,
+            pageSize=1000,
+            fields=FILES_FIELDS,
+            orderBy="modifiedTime asc",
+            pageToken=page_token
+        ).execute()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+
+
+def delete_files(service, files):
+    """Delete files from Google Drive using batch requests.
+
+    Returns the number of files deleted and the files whose delete failed.
+    """
+    by_id = {file['id']: file for file in files}
+    deleted = []
+    failed = []
+
+    def log_result(request_id, response, exception):
+        if exception is not None:
+            logger.warning(f"Batch delete failed for {by_id[request_id]['name']}: {exception}")
+            failed.append(by_id[request_id])
+        else:
+            deleted.append(request_id)
+            logger.info(f"Deleted: {by_id[request_id]['name']}")
+
+    for start in range(0, len(files), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=log_result)
+        for file in files[start:start + BATCH_SIZE]:
+            batch.add(service.files().delete(fileId=file['id']), request_id=file['id'])
+        batch.execute()
+
+    return len(deleted), failed
+
+
+async def delete_files_individually(token, files):
+    """Delete files one request each, with bounded concurrency.
+
+    Returns the files that still could not be deleted.
+    """
+    semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+    headers = {'Authorization': f"Bearer {token}"}
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def delete(file):
+            async with semaphore:
+                for attempt in range(MAX_ATTEMPTS):
+                    if attempt:
+                        await asyncio.sleep((2 ** attempt) * 0.25 + random.random() * 0.1)
+                    try:
+                        async with session.delete(f"{DRIVE_FILES_URL}/{file['id']}") as response:
+                            if response.status == 204:
+                                logger.info(f"Deleted: {file['name']}")
+                                return True
+                            if response.status == 404:
+                                logger.info(f"Already gone: {file['name']}")
+                                return True
+                            body = await response.text()
+                            retryable = response.status in RETRYABLE_STATUSES and (
+                                response.status != 403 or 'ratelimitexceeded' in body.lower()
+                            )
+                            if not retryable:
+                                logger.error(f"Failed to delete {file['name']}: HTTP {response.status}")
+                                return False
+                            logger.warning(f"Delete of {file['name']} got HTTP {response.status}, retrying")
+                    except aiohttp.ClientError as e:
+                        logger.warning(f"Delete of {file['name']} failed: {e}, retrying")
+                logger.error(f"Failed to delete {file['name']} after {MAX_ATTEMPTS} attempts")
+                return False
+
+        results = await asyncio.gather(*(delete(file) for file in files))
+
+    return [file for file, deleted in zip(files, results) if not deleted]
 
 
 def cleanup_old_files():
@@ -97,38 +177,40 @@ def cleanup_old_files():
     logger.info("Starting cleanup process...")
     logger.info(f"Will delete files older than {MAX_AGE_DAYS} days")
 
-    service = get_drive_service()
+    creds = get_credentials()
+    service = get_drive_service(creds)
     folder_id = get_folder_id(service)
 
     if not folder_id:
         logger.info("No folder found, nothing to clean up")
         return 0
 
-    files = list_files(service, folder_id)
-    logger.info(f"Found {len(files)} files in folder")
-
-    cutoff_date = datetime.now(timezone.utc) - timedelta(days=MAX_AGE_DAYS)
+    now = datetime.now(timezone.utc)
+    cutoff_date = now - timedelta(days=MAX_AGE_DAYS)
     logger.info(f"Cutoff date: {cutoff_date.isoformat()}")
 
-    deleted_count = 0
+    # Drive filters on modifiedTime, so only deletion candidates come back
+    files = list_files(service, folder_id, cutoff_date)
+    logger.info(f"Found {len(files)} files older than the cutoff")
 
     for file in files:
-        # Parse the modified time (ISO 8601 format)
-        modified_time = datetime.fromisoformat(
-            file['modifiedTime'].replace('Z', '+00:00')
+        # Parse the modified time (RFC 3339 format)
+        modified_time = ciso8601.parse_rfc3339(file['modifiedTime'])
+        age_days = (now - modified_time).days
+        logger.info(
+            f"File '{file['name']}' is {age_days} days old - DELETING"
         )
 
-        if modified_time < cutoff_date:
-            age_days = (datetime.now(timezone.utc) - modified_time).days
-            logger.info(
-                f"File '{file['name']}' is {age_days} days old - DELETING"
+    deleted_count, failed = delete_files(service, files)
+    if failed:
+        logger.info(f"Retrying {len(failed)} failed deletes individually")
+        remaining = asyncio.run(delete_files_individually(creds.token, failed))
+        deleted_count += len(failed) - len(remaining)
+        if remaining:
+            names = ', '.join(file['name'] for file in remaining)
+            raise RuntimeError(
+                f"Deleted {deleted_count} files but could not delete {len(remaining)}: {names}"
             )
-            delete_file(service, file['id'], file['name'])
-            deleted_count += 1
-        else:
-            age_days = (datetime.now(timezone.utc) - modified_time).days
-            logger.info(f"Keeping: {file['name']} ({age_days} days old)")
-
     logger.info(f"Cleanup complete. Deleted {deleted_count} files.")
     return deleted_count
 